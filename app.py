@@ -6,22 +6,69 @@ FastAPI-based microservice for email classification using Gemma model
 
 import os
 import time
+import asyncio
+import gzip
+import hashlib
 import logging
+import mmap
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
 
-from classifier_service import get_classifier_service, EmailClassifierService
+try:
+    import uvloop  # noqa: F401
+    _HAS_UVLOOP = True
+except ImportError:  # uvloop is unavailable on Windows
+    _HAS_UVLOOP = False
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Split the CPU between uvicorn workers; must be set before torch is imported
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+TORCH_THREADS = max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_DYNAMIC", "FALSE")
+
+from classifier_service import get_classifier_service, configure_torch_runtime, EmailClassifierService
+
+# Setup logging: records are handed to a listener thread so stderr writes never block the event loop
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = QueueListener(_log_queue, _log_handler)
+# The listener's handler does the formatting; the queue side passes the bare message through
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler], force=True)
+_log_listener.start()
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Web interface is read once at import and served from memory
+STATIC_DIR = Path(__file__).parent / "static"
+_INDEX_BYTES = (STATIC_DIR / "index.html").read_bytes()
+_INDEX_GZIP = gzip.compress(_INDEX_BYTES, compresslevel=9)
+_INDEX_ETAG = hashlib.md5(_INDEX_BYTES).hexdigest()
+_INDEX_HEADERS = {
+    "cache-control": "public, max-age=3600",
+    "etag": f'"{_INDEX_ETAG}"',
+    "vary": "accept-encoding",
+}
+_INDEX_GZIP_HEADERS = {
+    **_INDEX_HEADERS,
+    "etag": f'"{_INDEX_ETAG}-gzip"',
+    "content-encoding": "gzip",
+}
 
 # Pydantic models for API
+# The classify endpoints return the service's dicts directly; these models document them in /docs
 class ClassificationResponse(BaseModel):
     file_name: str
     classification: Optional[str]
@@ -30,6 +77,7 @@ class ClassificationResponse(BaseModel):
     processing_time_ms: float
     model_version: str
     error: Optional[str] = None
+    raw_model_output: Optional[str] = None
 
 class BatchClassificationResponse(BaseModel):
     results: List[ClassificationResponse]
@@ -60,357 +108,281 @@ app = FastAPI(
     description="Microservice for classifying emails as phishing, spam, or benign using Gemma-3-270m-it model",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
+)
+
+# Explicit origin allow-list; wildcard origins cannot be combined with credentials
+CORS_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:8000").split(",")
+    if origin.strip()
+)
+
+class AllowListCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware that checks listed origins with a single frozenset lookup"""
+    
+    def __init__(self, app, allow_origins=(), allow_origin_regex=None, **kwargs):
+        super().__init__(app, allow_origins=allow_origins, allow_origin_regex=allow_origin_regex, **kwargs)
+        self._origin_set = frozenset(allow_origins)
+    
+    def is_allowed_origin(self, origin: str) -> bool:
+        if self.allow_all_origins or origin in self._origin_set:
+            return True
+        # allow_origin_regex is compiled by CORSMiddleware and still applies to unlisted origins
+        return self.allow_origin_regex is not None and self.allow_origin_regex.fullmatch(origin) is not None
+
+# Upload limits
+MAX_FILE_SIZE = 10 * 1024 * 1024
+MAX_BATCH_FILES = 10
+READ_CHUNK_SIZE = 64 * 1024
+
+class BodySizeLimitMiddleware:
+    """
+    Enforces a per-route request body limit before the endpoint parses the multipart form:
+    a declared Content-Length over the limit is answered with 413 without reading the body,
+    and a body streamed without one is cut off as soon as the bytes received cross the limit.
+    """
+    
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+    
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                response = JSONResponse({"detail": "Request too large"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises an HTTPException from body parsing, so this becomes the 413
+                    raise HTTPException(status_code=413, detail="Request too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+# Added before CORS so that CORS stays the outer layer and 413 responses carry its headers
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/classify/upload": MAX_FILE_SIZE + READ_CHUNK_SIZE,
+        "/classify/batch": MAX_BATCH_FILES * (MAX_FILE_SIZE + READ_CHUNK_SIZE),
+    },
 )
 
 # Add CORS middleware
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    AllowListCORSMiddleware,
+    allow_origins=sorted(CORS_ORIGINS),
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Only what the routes use, so preflight responses are built from fixed lists
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
 # Global classifier service
 classifier_service: Optional[EmailClassifierService] = None
 
+# Inference thread pool size
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "4"))
+
+# Concurrent single uploads are coalesced into batches of up to this size
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "8"))
+COALESCE_WINDOW_S = float(os.getenv("COALESCE_WINDOW_MS", "5")) / 1000
+_upload_queue: Optional[asyncio.Queue] = None
+_coalescer_task: Optional[asyncio.Task] = None
+
+# Number of model calls allowed to run at once (1 suits a single GPU or a fully threaded CPU)
+INFER_CONCURRENCY = max(1, int(os.getenv("INFER_CONCURRENCY", "1")))
+_infer_semaphore: Optional[asyncio.Semaphore] = None
+
+# Prebuilt payloads for files that could not be classified; never mutated, only copied
+_ERROR_TEMPLATE = {
+    "classification": None,
+    "confidence_scores": [],
+    "metadata": {},
+    "processing_time_ms": 0.0,
+    "error": None
+}
+_UNSUPPORTED_FILE = {**_ERROR_TEMPLATE, "error": "Only .eml files are supported"}
+_FILE_TOO_LARGE = {**_ERROR_TEMPLATE, "error": "File too large. Maximum size is 10MB"}
+
+def _error_response(filename: str, template: dict = _ERROR_TEMPLATE, **overrides) -> dict:
+    """Copy an error template with the per-file fields filled in"""
+    return {**template, "file_name": filename, "model_version": classifier_service.model_id, **overrides}
+
+# /health and /stats serve a snapshot refreshed at most this often
+SNAPSHOT_TTL_S = 0.5
+_snapshots = {}
+
+def _snapshot(name: str, producer):
+    """Return a cached producer() result, refreshing it once it is older than SNAPSHOT_TTL_S"""
+    now = time.monotonic()
+    cached = _snapshots.get(name)
+    if cached is None or now - cached[0] > SNAPSHOT_TTL_S:
+        cached = (now, producer())
+        _snapshots[name] = cached
+    return cached[1]
+
+async def _read_upload(file: UploadFile) -> Optional[memoryview]:
+    """
+    Read an upload in chunks, returning None as soon as it exceeds MAX_FILE_SIZE.
+    The buffer is returned as a memoryview so it reaches the parser without another copy;
+    release it with _release_upload once classification is done.
+    """
+    spooled = file.file
+    if getattr(spooled, "_rolled", False):
+        # Starlette already spooled this upload to disk: map it read-only instead of copying it
+        size = os.fstat(spooled.fileno()).st_size
+        if size > MAX_FILE_SIZE:
+            return None
+        if size:
+            return memoryview(mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ))
+    
+    buf = bytearray()
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return memoryview(buf)
+        buf.extend(chunk)
+        if len(buf) > MAX_FILE_SIZE:
+            return None
+
+def _release_upload(content):
+    """Unmap an upload returned by _read_upload if it is backed by a file mapping"""
+    if not isinstance(content, memoryview):
+        return
+    backing = content.obj
+    try:
+        content.release()
+        if isinstance(backing, mmap.mmap):
+            backing.close()
+    except BufferError:
+        # Still in use by an abandoned classification; the mapping closes when collected
+        pass
+
+async def _run_inference(func, *args):
+    """Run a blocking model call in the thread pool, waiting for a free inference slot"""
+    async with _infer_semaphore:
+        return await asyncio.to_thread(func, *args)
+
+async def _coalesce_uploads():
+    """Collect queued single uploads for a short window and classify them as one batch"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await _upload_queue.get()]
+        deadline = loop.time() + COALESCE_WINDOW_S
+        while len(items) < COALESCE_MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(_upload_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        # The coalescer owns every queued buffer; uploads whose client already went away are dropped
+        live = []
+        for content, name, future in items:
+            if future.done():
+                _release_upload(content)
+            else:
+                live.append((content, name, future))
+        if not live:
+            continue
+        try:
+            await _classify_coalesced(live)
+        finally:
+            for content, _, _ in live:
+                _release_upload(content)
+
+async def _classify_coalesced(items):
+    """Classify coalesced uploads together, retrying one by one if the batch fails"""
+    contents = [content for content, _, _ in items]
+    names = [name for _, name, _ in items]
+    try:
+        outcomes = await _run_inference(classifier_service.classify_bytes_batch, contents, names)
+    except Exception as e:
+        logger.error("Coalesced classification failed, retrying uploads one by one: %s", e)
+        # classify_bytes turns a failure into an error entry for that upload alone, so the
+        # other clients' requests still succeed and the bad one gets a 200 with its error
+        outcomes = []
+        for content, name in zip(contents, names):
+            try:
+                outcomes.append(await _run_inference(classifier_service.classify_bytes, content, name))
+            except Exception as item_error:
+                outcomes.append(item_error)
+    
+    for (_, _, future), outcome in zip(items, outcomes):
+        # The client may have disconnected and cancelled its future
+        if future.done():
+            continue
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize the classifier service on startup"""
-    global classifier_service
+    global classifier_service, _upload_queue, _coalescer_task, _infer_semaphore
     try:
         logger.info("🚀 Starting Email Classification API...")
+        # Bound the number of concurrent model calls dispatched via asyncio.to_thread
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+        )
+        configure_torch_runtime(TORCH_THREADS)
         classifier_service = get_classifier_service()
+        try:
+            classifier_service.warmup()
+        except Exception as e:
+            # A cold model still serves requests, only the first ones are slower
+            logger.warning("⚠️  Model warmup failed, continuing without it: %s", e)
+        _infer_semaphore = asyncio.Semaphore(INFER_CONCURRENCY)
+        _upload_queue = asyncio.Queue()
+        _coalescer_task = asyncio.create_task(_coalesce_uploads())
         logger.info("✅ Classifier service initialized successfully")
     except Exception as e:
-        logger.error(f"❌ Failed to initialize classifier service: {e}")
+        logger.error("❌ Failed to initialize classifier service: %s", e)
         raise
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("🛑 Shutting down Email Classification API...")
+    if _coalescer_task:
+        _coalescer_task.cancel()
+    if classifier_service:
+        classifier_service.close()
+    _log_listener.stop()
 
 # API Routes
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    """Serve the main web interface"""
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Email Classification API</title>
-        <style>
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 20px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                color: #333;
-            }
-            .container {
-                background: white;
-                border-radius: 15px;
-                padding: 30px;
-                box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-            }
-            h1 {
-                color: #4a5568;
-                text-align: center;
-                margin-bottom: 30px;
-            }
-            .upload-area {
-                border: 3px dashed #cbd5e0;
-                border-radius: 10px;
-                padding: 40px;
-                text-align: center;
-                margin: 20px 0;
-                transition: all 0.3s ease;
-            }
-            .upload-area:hover {
-                border-color: #667eea;
-                background-color: #f7fafc;
-            }
-            .btn {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                border: none;
-                padding: 12px 30px;
-                border-radius: 25px;
-                cursor: pointer;
-                font-size: 16px;
-                transition: transform 0.2s;
-            }
-            .btn:hover {
-                transform: translateY(-2px);
-            }
-            .result {
-                margin-top: 20px;
-                padding: 20px;
-                border-radius: 10px;
-                background-color: #f8f9fa;
-            }
-            .classification {
-                font-size: 24px;
-                font-weight: bold;
-                margin: 10px 0;
-            }
-            .phishing { color: #e53e3e; }
-            .spam { color: #dd6b20; }
-            .benign { color: #38a169; }
-            .metadata {
-                background: #edf2f7;
-                padding: 15px;
-                border-radius: 8px;
-                margin-top: 15px;
-            }
-            .api-links {
-                text-align: center;
-                margin-top: 30px;
-            }
-            .api-links a {
-                margin: 0 15px;
-                color: #667eea;
-                text-decoration: none;
-                font-weight: bold;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🛡️ Email Classification API</h1>
-            <p style="text-align: center; color: #666; font-size: 18px;">
-                Upload an email (.eml) file to classify it as <strong>phishing</strong>, <strong>spam</strong>, or <strong>benign</strong>
-            </p>
-            
-            <div class="upload-area" id="uploadArea">
-                <p>📧 Drag and drop your .eml file(s) here or click to browse</p>
-                <input type="file" id="fileInput" accept=".eml" multiple style="display: none;">
-                <button class="btn" onclick="document.getElementById('fileInput').click()">
-                    Choose File(s)
-                </button>
-                <p style="font-size: 14px; color: #666; margin-top: 10px;">
-                    💡 Select multiple files for batch processing
-                </p>
-            </div>
-            
-            <div style="text-align: center; margin: 20px 0;">
-                <button class="btn" id="uploadBtn" onclick="uploadFile()" disabled>
-                    🔍 Classify Email
-                </button>
-            </div>
-            
-            <div id="result" class="result" style="display: none;"></div>
-            
-            <div class="api-links">
-                <a href="/docs" target="_blank">📚 API Documentation</a>
-                <a href="/health">🏥 Health Check</a>
-                <a href="/stats">📊 Statistics</a>
-            </div>
-        </div>
-
-        <script>
-            const fileInput = document.getElementById('fileInput');
-            const uploadBtn = document.getElementById('uploadBtn');
-            const uploadArea = document.getElementById('uploadArea');
-            const result = document.getElementById('result');
-            
-            fileInput.addEventListener('change', function(e) {
-                if (e.target.files.length > 0) {
-                    uploadBtn.disabled = false;
-                    const fileCount = e.target.files.length;
-                    if (fileCount === 1) {
-                        uploadArea.innerHTML = `<p>📧 Selected: ${e.target.files[0].name}</p>`;
-                        uploadBtn.textContent = '🔍 Classify Email';
-                    } else {
-                        uploadArea.innerHTML = `<p>📧 Selected: ${fileCount} files</p>`;
-                        uploadBtn.textContent = `🔍 Classify ${fileCount} Emails`;
-                    }
-                }
-            });
-            
-            // Drag and drop functionality
-            uploadArea.addEventListener('dragover', function(e) {
-                e.preventDefault();
-                uploadArea.style.borderColor = '#667eea';
-                uploadArea.style.backgroundColor = '#f7fafc';
-            });
-            
-            uploadArea.addEventListener('dragleave', function(e) {
-                e.preventDefault();
-                uploadArea.style.borderColor = '#cbd5e0';
-                uploadArea.style.backgroundColor = 'white';
-            });
-            
-            uploadArea.addEventListener('drop', function(e) {
-                e.preventDefault();
-                uploadArea.style.borderColor = '#cbd5e0';
-                uploadArea.style.backgroundColor = 'white';
-                
-                const files = e.dataTransfer.files;
-                const emlFiles = Array.from(files).filter(f => f.name.endsWith('.eml'));
-                
-                if (emlFiles.length > 0) {
-                    fileInput.files = files;
-                    uploadBtn.disabled = false;
-                    
-                    if (emlFiles.length === 1) {
-                        uploadArea.innerHTML = `<p>📧 Selected: ${emlFiles[0].name}</p>`;
-                        uploadBtn.textContent = '🔍 Classify Email';
-                    } else {
-                        uploadArea.innerHTML = `<p>📧 Selected: ${emlFiles.length} .eml files</p>`;
-                        uploadBtn.textContent = `🔍 Classify ${emlFiles.length} Emails`;
-                    }
-                } else {
-                    uploadArea.innerHTML = `<p style="color: red;">❌ Please select .eml files only</p>`;
-                }
-            });
-            
-            async function uploadFile() {
-                const files = fileInput.files;
-                if (!files || files.length === 0) return;
-                
-                uploadBtn.disabled = true;
-                uploadBtn.textContent = '🔄 Processing...';
-                result.style.display = 'none';
-                
-                const formData = new FormData();
-                
-                try {
-                    if (files.length === 1) {
-                        // Single file upload
-                        formData.append('file', files[0]);
-                        
-                        const response = await fetch('/classify/upload', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        
-                        const data = await response.json();
-                        displaySingleResult(data);
-                    } else {
-                        // Batch upload
-                        for (let i = 0; i < files.length; i++) {
-                            formData.append('files', files[i]);
-                        }
-                        
-                        const response = await fetch('/classify/batch', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        
-                        const data = await response.json();
-                        displayBatchResults(data);
-                    }
-                } catch (error) {
-                    result.innerHTML = `<div style="color: red;">❌ Error: ${error.message}</div>`;
-                    result.style.display = 'block';
-                } finally {
-                    uploadBtn.disabled = false;
-                    uploadBtn.textContent = files.length === 1 ? '🔍 Classify Email' : `🔍 Classify ${files.length} Emails`;
-                }
-            }
-            
-            function displaySingleResult(data) {
-                if (data.error) {
-                    result.innerHTML = `<div style="color: red;">❌ Error: ${data.error}</div>`;
-                } else {
-                    const classification = data.classification || 'unknown';
-                    const confidence = data.confidence_scores.length > 0 ? 
-                        (data.confidence_scores[0].score * 100).toFixed(1) : 'N/A';
-                    
-                    result.innerHTML = `
-                        <h3>Classification Result</h3>
-                        <div class="classification ${classification}">
-                            🏷️ ${classification.toUpperCase()}
-                        </div>
-                        <p><strong>Confidence:</strong> ${confidence}%</p>
-                        <p><strong>Processing Time:</strong> ${data.processing_time_ms}ms</p>
-                        
-                        <div class="metadata">
-                            <h4>📧 Email Metadata</h4>
-                            <p><strong>Subject:</strong> ${data.metadata.subject || 'N/A'}</p>
-                            <p><strong>From:</strong> ${data.metadata.sender || 'N/A'}</p>
-                            <p><strong>To:</strong> ${data.metadata.recipient || 'N/A'}</p>
-                        </div>
-                        
-                        <details style="margin-top: 15px;">
-                            <summary>🔍 Detailed Scores</summary>
-                            <pre>${JSON.stringify(data.confidence_scores, null, 2)}</pre>
-                        </details>
-                    `;
-                }
-                result.style.display = 'block';
-            }
-            
-            function displayBatchResults(data) {
-                if (!data.results || data.results.length === 0) {
-                    result.innerHTML = `<div style="color: red;">❌ No results received</div>`;
-                    result.style.display = 'block';
-                    return;
-                }
-                
-                const totalFiles = data.total_files;
-                const successful = data.successful_classifications;
-                const failed = data.failed_classifications;
-                const totalTime = data.total_processing_time_ms;
-                
-                let html = `
-                    <h3>Batch Classification Results</h3>
-                    <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; margin-bottom: 20px;">
-                        <p><strong>📊 Summary:</strong></p>
-                        <p>• Total Files: ${totalFiles}</p>
-                        <p>• Successful: ${successful}</p>
-                        <p>• Failed: ${failed}</p>
-                        <p>• Total Processing Time: ${totalTime.toFixed(0)}ms</p>
-                        <p>• Average Time per File: ${(totalTime / totalFiles).toFixed(0)}ms</p>
-                    </div>
-                    
-                    <div style="max-height: 400px; overflow-y: auto;">
-                `;
-                
-                data.results.forEach((item, index) => {
-                    const classification = item.classification || 'unknown';
-                    const confidence = item.confidence_scores.length > 0 ? 
-                        (item.confidence_scores[0].score * 100).toFixed(1) : 'N/A';
-                    
-                    html += `
-                        <div style="border: 1px solid #ddd; margin: 10px 0; padding: 15px; border-radius: 8px; background: white;">
-                            <h4 style="margin: 0 0 10px 0;">📧 ${item.file_name}</h4>
-                            <div class="classification ${classification}" style="font-size: 18px; margin: 10px 0;">
-                                🏷️ ${classification.toUpperCase()}
-                            </div>
-                            <p><strong>Confidence:</strong> ${confidence}%</p>
-                            <p><strong>Processing Time:</strong> ${item.processing_time_ms}ms</p>
-                            ${item.error ? `<p style="color: red;"><strong>Error:</strong> ${item.error}</p>` : ''}
-                            
-                            <details style="margin-top: 10px;">
-                                <summary>📧 Email Details</summary>
-                                <div style="margin-top: 10px; font-size: 14px;">
-                                    <p><strong>Subject:</strong> ${item.metadata.subject || 'N/A'}</p>
-                                    <p><strong>From:</strong> ${item.metadata.sender || 'N/A'}</p>
-                                    <p><strong>To:</strong> ${item.metadata.recipient || 'N/A'}</p>
-                                </div>
-                            </details>
-                        </div>
-                    `;
-                });
-                
-                html += '</div>';
-                result.innerHTML = html;
-                result.style.display = 'block';
-            }
-        </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html_content)
+async def root(request: Request):
+    """Serve the main web interface, pre-compressed when the client accepts gzip"""
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        content, headers = _INDEX_GZIP, _INDEX_GZIP_HEADERS
+    else:
+        content, headers = _INDEX_BYTES, _INDEX_HEADERS
+    # Revalidation of an unchanged page gets an empty 304
+    if headers["etag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="text/html", headers=headers)
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -418,8 +390,7 @@ async def health_check():
     if not classifier_service:
         raise HTTPException(status_code=503, detail="Classifier service not initialized")
     
-    health_data = classifier_service.health_check()
-    return HealthResponse(**health_data)
+    return _snapshot("health", classifier_service.health_check)
 
 @app.get("/stats", response_model=StatsResponse)
 async def get_stats():
@@ -427,10 +398,9 @@ async def get_stats():
     if not classifier_service:
         raise HTTPException(status_code=503, detail="Classifier service not initialized")
     
-    stats_data = classifier_service.get_stats()
-    return StatsResponse(**stats_data)
+    return _snapshot("stats", classifier_service.get_stats)
 
-@app.post("/classify/upload", response_model=ClassificationResponse)
+@app.post("/classify/upload", responses={200: {"model": ClassificationResponse}})
 async def classify_upload(file: UploadFile = File(...)):
     """
     Upload and classify a single email file
@@ -442,21 +412,28 @@ async def classify_upload(file: UploadFile = File(...)):
     if not file.filename.endswith('.eml'):
         raise HTTPException(status_code=400, detail="Only .eml files are supported")
     
-    # Check file size (max 10MB)
-    content = await file.read()
-    if len(content) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Maximum size is 10MB")
+    # Check file size (max 10MB), stopping as soon as the limit is crossed
+    content = await _read_upload(file)
+    if content is None:
+        raise HTTPException(status_code=413, detail="File too large. Maximum size is 10MB")
     
+    queued = False
     try:
-        # Classify the email
-        result = classifier_service.classify_bytes(content, file.filename)
-        return ClassificationResponse(**result)
+        # Classify the email as part of the next coalesced batch
+        future = asyncio.get_running_loop().create_future()
+        await _upload_queue.put((content, file.filename, future))
+        # From here the coalescer releases the buffer, even if this request is cancelled
+        queued = True
+        return await future
     
     except Exception as e:
-        logger.error(f"Classification error: {e}")
+        logger.error("Classification error: %s", e)
         raise HTTPException(status_code=500, detail=f"Classification failed: {str(e)}")
+    finally:
+        if not queued:
+            _release_upload(content)
 
-@app.post("/classify/batch", response_model=BatchClassificationResponse)
+@app.post("/classify/batch", responses={200: {"model": BatchClassificationResponse}})
 async def classify_batch(files: List[UploadFile] = File(...)):
     """
     Upload and classify multiple email files
@@ -464,72 +441,64 @@ async def classify_batch(files: List[UploadFile] = File(...)):
     if not classifier_service:
         raise HTTPException(status_code=503, detail="Classifier service not initialized")
     
-    if len(files) > 10:
+    if len(files) > MAX_BATCH_FILES:
         raise HTTPException(status_code=400, detail="Maximum 10 files allowed per batch")
     
-    results = []
-    successful = 0
-    failed = 0
+    results: List[Optional[dict]] = [None] * len(files)
     total_time = 0
     
-    for file in files:
-        if not file.filename.endswith('.eml'):
-            results.append(ClassificationResponse(
-                file_name=file.filename,
-                classification=None,
-                confidence_scores=[],
-                metadata={},
-                processing_time_ms=0,
-                model_version=classifier_service.model_id,
-                error="Only .eml files are supported"
-            ))
-            failed += 1
-            continue
-        
-        try:
-            content = await file.read()
-            if len(content) > 10 * 1024 * 1024:
-                results.append(ClassificationResponse(
-                    file_name=file.filename,
-                    classification=None,
-                    confidence_scores=[],
-                    metadata={},
-                    processing_time_ms=0,
-                    model_version=classifier_service.model_id,
-                    error="File too large. Maximum size is 10MB"
-                ))
-                failed += 1
-                continue
-            
-            result = classifier_service.classify_bytes(content, file.filename)
-            results.append(ClassificationResponse(**result))
-            total_time += result['processing_time_ms']
-            
-            if result['error']:
-                failed += 1
-            else:
-                successful += 1
-                
-        except Exception as e:
-            logger.error(f"Batch classification error for {file.filename}: {e}")
-            results.append(ClassificationResponse(
-                file_name=file.filename,
-                classification=None,
-                confidence_scores=[],
-                metadata={},
-                processing_time_ms=0,
-                model_version=classifier_service.model_id,
-                error=str(e)
-            ))
-            failed += 1
-    
-    return BatchClassificationResponse(
-        results=results,
-        total_files=len(files),
-        successful_classifications=successful,
-        failed_classifications=failed,
-        total_processing_time_ms=total_time
+    # Read every .eml upload concurrently; reject other extensions up front
+    eml_indices = []
+    for i, file in enumerate(files):
+        if file.filename.endswith('.eml'):
+            eml_indices.append(i)
+        else:
+            results[i] = _error_response(file.filename, _UNSUPPORTED_FILE)
+    contents = await asyncio.gather(
+        *(_read_upload(files[i]) for i in eml_indices), return_exceptions=True
     )
+    
+    # Validate sizes, then run every valid file through one batched model call
+    batch_indices = []
+    batch_contents = []
+    for i, content in zip(eml_indices, contents):
+        filename = files[i].filename
+        if isinstance(content, Exception):
+            results[i] = _error_response(filename, error=str(content))
+        elif content is None:
+            results[i] = _error_response(filename, _FILE_TOO_LARGE)
+        else:
+            batch_indices.append(i)
+            batch_contents.append(content)
+    batch_names = [files[i].filename for i in batch_indices]
+    
+    try:
+        outcomes = await _run_inference(
+            classifier_service.classify_bytes_batch, batch_contents, batch_names
+        )
+    except Exception as e:
+        logger.error("Batch classification error: %s", e)
+        outcomes = None
+        for i in batch_indices:
+            results[i] = _error_response(files[i].filename, error=str(e))
+    finally:
+        for content in batch_contents:
+            _release_upload(content)
+    
+    for i, outcome in zip(batch_indices, outcomes or []):
+        results[i] = outcome
+        total_time += outcome['processing_time_ms']
+    
+    successful = sum(1 for r in results if not r["error"])
+    failed = len(results) - successful
+    
+    return {
+        "results": results,
+        "total_files": len(files),
+        "successful_classifications": successful,
+        "failed_classifications": failed,
+        "total_processing_time_ms": total_time
+    }
 
 @app.delete("/cache")
 async def clear_cache():
@@ -548,7 +517,9 @@ async def get_models():
             "id": "google/gemma-3-270m-it",
             "name": "Gemma 3 270M Instruction Tuned",
             "description": "Google's Gemma 3 model with 270M parameters, fine-tuned for instruction following",
-            "labels": ["phishing", "spam", "benign"]
+            "labels": ["phishing", "spam", "benign"],
+            "quantization": (classifier_service.quantization if classifier_service else None) or "none",
+            "backend": classifier_service.backend if classifier_service else None
         },
         "model_info": {
             "parameters": "270M",
@@ -563,6 +534,9 @@ if __name__ == "__main__":
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=WEB_CONCURRENCY == 1,
+        workers=WEB_CONCURRENCY,
+        loop="uvloop" if _HAS_UVLOOP else "asyncio",
+        http="httptools",
         log_level="info"
     )
@@ -6,7 +6,12 @@ Wrapper around the existing email_classifier.py with additional features for mic
 
 import os
 import time
+import hashlib
+import json
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional, Union
 from dataclasses import asdict
 from email_classifier import GemmaEmailClassifier, ClassificationResult
@@ -25,20 +30,43 @@ class EmailClassifierService:
         model_id: str = "google/gemma-3-270m-it",
         labels: Optional[List[str]] = None,
         hf_token: Optional[str] = None,
-        cache_enabled: bool = True
+        cache_enabled: bool = True,
+        cache_max_size: int = 1024,
+        quantization: Optional[str] = None,
+        compile_model: bool = False,
+        backend: str = "hf",
+        kv_cache_dtype: str = "fp8",
+        parse_workers: int = 0,
+        fast_path: bool = False,
+        prefix_cache: bool = False,
+        cache_db_path: Optional[str] = None
     ):
         self.model_id = model_id
         self.labels = labels or ["phishing", "spam", "benign"]
         self.cache_enabled = cache_enabled
+        self.cache_max_size = cache_max_size
+        self.quantization = quantization
+        self.compile_model = compile_model
+        self.backend = backend
+        self.kv_cache_dtype = kv_cache_dtype
+        self.parse_workers = parse_workers
+        self.fast_path = fast_path
+        self.prefix_cache = prefix_cache
         self._classifier = None
         self._model_loaded = False
-        self._classification_cache = {} if cache_enabled else None
+        # LRU of result dicts keyed by (model_id, sha256 of the raw email)
+        self._classification_cache = OrderedDict() if cache_enabled else None
+        # Optional SQLite store behind the LRU so results survive restarts
+        self._cache_db = self._open_cache_db(cache_db_path) if cache_enabled and cache_db_path else None
         self._stats = {
             "total_classifications": 0,
             "cache_hits": 0,
-            "errors": 0,
-            "avg_processing_time": 0.0
+            "errors": 0
         }
+        # Summed rather than kept as a running mean; avg_processing_time is derived on read
+        self._total_processing_time = 0.0
+        # Guards stats and cache updates when called from a thread pool
+        self._lock = threading.Lock()
         
         # Initialize classifier
         self._load_model(hf_token)
@@ -46,13 +74,23 @@ class EmailClassifierService:
     def _load_model(self, hf_token: Optional[str] = None):
         """Load the classification model"""
         try:
-            logger.info(f"Loading model: {self.model_id}")
+            logger.info(
+                f"Loading model: {self.model_id} "
+                f"(backend: {self.backend}, quantization: {self.quantization or 'none'})"
+            )
             start_time = time.time()
             
             self._classifier = GemmaEmailClassifier(
                 model_id=self.model_id,
                 labels=self.labels,
-                hf_token=hf_token
+                hf_token=hf_token,
+                quantization=self.quantization,
+                compile_model=self.compile_model,
+                backend=self.backend,
+                kv_cache_dtype=self.kv_cache_dtype,
+                parse_workers=self.parse_workers,
+                fast_path=self.fast_path,
+                prefix_cache=self.prefix_cache
             )
             
             load_time = time.time() - start_time
@@ -64,16 +102,80 @@ class EmailClassifierService:
             self._model_loaded = False
             raise
     
-    def _get_file_hash(self, filepath: str) -> str:
-        """Generate a simple hash for file caching"""
-        import hashlib
+    def warmup(
+        self,
+        seq_lens: List[int] = (256, 512, 1024, 2048),
+        batch_sizes: List[int] = (1, 4, 8)
+    ):
+        """
+        Prime the model before serving traffic
+        
+        A compiled model is warmed over every shape so graph capture happens at startup;
+        its inputs are padded to power-of-two lengths, and templated prompts (system prompt
+        plus at most 4000 characters of email) fall between 256 and 2048 tokens.
+        An eager model only needs the dummy classification and one small forward.
+        """
+        start_time = time.time()
+        if self._classifier.compiled:
+            self._classifier.warmup(seq_lens=seq_lens, batch_sizes=batch_sizes)
+        else:
+            self._classifier.warmup()
+        logger.info(f"Model warmed up in {time.time() - start_time:.2f} seconds")
+    
+    def _content_key(self, content: Union[bytes, memoryview]) -> tuple:
+        """Cache key for raw email bytes; includes the model so a model swap invalidates it"""
+        return (self.model_id, hashlib.sha256(content).digest())
+    
+    def _get_file_hash(self, filepath: str) -> Optional[tuple]:
+        """Cache key for a file from its path, size and mtime, so the file is not read just to look it up"""
         try:
-            with open(filepath, 'rb') as f:
-                content = f.read()
-            return hashlib.md5(content).hexdigest()
-        except Exception:
+            st = os.stat(filepath)
+            return (self.model_id, os.path.realpath(filepath), st.st_size, st.st_mtime_ns)
+        except OSError:
             return None
     
+    @staticmethod
+    def _open_cache_db(path: str) -> sqlite3.Connection:
+        """Open (creating if needed) the persistent result cache"""
+        # Autocommit; every access happens under self._lock, so sharing across threads is safe
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        logger.info(f"Persistent cache opened at {path}")
+        return conn
+    
+    def _cache_get(self, key: tuple) -> Optional[Dict]:
+        """Look up a cached result, counting the hit and refreshing its LRU position"""
+        with self._lock:
+            cached = self._classification_cache.get(key)
+            if cached is not None:
+                self._classification_cache.move_to_end(key)
+            elif self._cache_db is not None:
+                row = self._cache_db.execute("SELECT result FROM cache WHERE key = ?", (repr(key),)).fetchone()
+                if row is not None:
+                    cached = json.loads(row[0])
+                    self._lru_put(key, cached)
+            if cached is not None:
+                self._stats["cache_hits"] += 1
+            return cached
+    
+    def _cache_put(self, key: tuple, result_dict: Dict):
+        """Store a result, writing it through to the persistent cache when there is one"""
+        with self._lock:
+            self._lru_put(key, result_dict)
+            if self._cache_db is not None:
+                self._cache_db.execute(
+                    "INSERT OR REPLACE INTO cache (key, result) VALUES (?, ?)", (repr(key), json.dumps(result_dict))
+                )
+    
+    def _lru_put(self, key: tuple, result_dict: Dict):
+        """Insert into the in-memory LRU, evicting past cache_max_size; caller holds self._lock"""
+        self._classification_cache[key] = result_dict
+        self._classification_cache.move_to_end(key)
+        while len(self._classification_cache) > self.cache_max_size:
+            self._classification_cache.popitem(last=False)
+    
     def classify_file(self, filepath: str, use_cache: bool = True) -> Dict:
         """
         Classify a single email file
@@ -88,72 +190,73 @@ class EmailClassifierService:
         if not self._model_loaded:
             raise RuntimeError("Model not loaded. Cannot perform classification.")
         
+        file_name = os.path.basename(filepath)
+        
         # Check cache
         file_hash = None
         if self.cache_enabled and use_cache:
             file_hash = self._get_file_hash(filepath)
-            if file_hash and file_hash in self._classification_cache:
-                self._stats["cache_hits"] += 1
-                logger.info(f"Cache hit for file: {os.path.basename(filepath)}")
-                return self._classification_cache[file_hash]
+            cached = self._cache_get(file_hash) if file_hash else None
+            if cached is not None:
+                logger.debug("Cache hit for file: %s", file_name)
+                return cached
+        
+        return self._classify_single(
+            self._classifier.classify_eml_file, filepath, file_name, file_hash, cache_errors=True
+        )
+    
+    def classify_bytes(self, file_content: Union[bytes, memoryview], filename: str = "uploaded_file.eml") -> Dict:
+        """
+        Classify email from bytes content, parsing it in memory
         
+        Args:
+            file_content: Raw bytes of the .eml file (a memoryview is used without copying)
+            filename: Name of the file for reference
+            
+        Returns:
+            Dictionary with classification results
+        """
+        if not self._model_loaded:
+            raise RuntimeError("Model not loaded. Cannot perform classification.")
+        
+        # Identical uploads are served from the cache
+        key = None
+        if self.cache_enabled:
+            key = self._content_key(file_content)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return {**cached, "file_name": filename}
+        
+        return self._classify_single(self._classifier.classify_eml_bytes, file_content, filename, key)
+    
+    def _classify_single(self, classify, source, file_name: str, key: Optional[tuple], cache_errors: bool = False) -> Dict:
+        """Run one classification, recording stats, caching the result and turning exceptions into error dicts"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
             
             # Perform classification
-            result = self._classifier.classify_eml_file(filepath)
-            processing_time = time.time() - start_time
+            result = classify(source)
+            processing_time = time.perf_counter() - start_time
             
-            # Convert to dictionary format
-            result_dict = {
-                "file_name": os.path.basename(filepath),
-                "classification": result.chosen,
-                "confidence_scores": [
-                    {"label": label, "score": score} 
-                    for label, score in result.scores
-                ],
-                "metadata": {
-                    "subject": result.subject,
-                    "sender": result.sender,
-                    "recipient": result.recipient,
-                    "date": None  # Add date parsing if needed
-                },
-                "processing_time_ms": round(processing_time * 1000, 2),
-                "model_version": self.model_id,
-                "error": result.error,
-                "raw_model_output": result.raw_model_output
-            }
-            
-            # Update stats
-            self._stats["total_classifications"] += 1
-            if result.error:
-                self._stats["errors"] += 1
-            
-            # Update average processing time
-            total = self._stats["total_classifications"]
-            current_avg = self._stats["avg_processing_time"]
-            self._stats["avg_processing_time"] = (
-                (current_avg * (total - 1) + processing_time) / total
-            )
+            result_dict = self._result_to_dict(result, file_name, processing_time)
+            self._record(processing_time, 1, 1 if result.error else 0)
             
             # Cache result
-            if self.cache_enabled and file_hash:
-                self._classification_cache[file_hash] = result_dict
+            if key and (cache_errors or not result.error):
+                self._cache_put(key, result_dict)
             
-            logger.info(
-                f"Classified {os.path.basename(filepath)}: "
-                f"{result.chosen} ({processing_time:.2f}s)"
-            )
+            logger.debug("Classified %s: %s (%.2fs)", file_name, result.chosen, processing_time)
             
             return result_dict
             
         except Exception as e:
-            self._stats["errors"] += 1
-            error_msg = f"Classification failed for {filepath}: {str(e)}"
+            with self._lock:
+                self._stats["errors"] += 1
+            error_msg = f"Classification failed for {file_name}: {str(e)}"
             logger.error(error_msg)
             
             return {
-                "file_name": os.path.basename(filepath),
+                "file_name": file_name,
                 "classification": None,
                 "confidence_scores": [],
                 "metadata": {},
@@ -163,38 +266,61 @@ class EmailClassifierService:
                 "raw_model_output": None
             }
     
-    def classify_bytes(self, file_content: bytes, filename: str = "uploaded_file.eml") -> Dict:
+    def classify_bytes_batch(self, contents: List[Union[bytes, memoryview]], filenames: List[str]) -> List[Dict]:
         """
-        Classify email from bytes content
+        Classify several emails from bytes with one batched model call
         
         Args:
-            file_content: Raw bytes of the .eml file
-            filename: Name of the file for reference
+            contents: Raw bytes of each .eml file (memoryviews are used without copying)
+            filenames: Names of the files for reference
             
         Returns:
-            Dictionary with classification results
+            List of classification results, in input order
         """
-        import tempfile
+        if not self._model_loaded:
+            raise RuntimeError("Model not loaded. Cannot perform classification.")
         
-        # Write bytes to temporary file
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.eml', delete=False) as tmp_file:
-            tmp_file.write(file_content)
-            tmp_path = tmp_file.name
+        # Serve identical uploads from the cache and only run the misses
+        result_dicts: List[Optional[Dict]] = [None] * len(contents)
+        keys: List[Optional[tuple]] = [None] * len(contents)
+        misses = []
+        for i, (content, filename) in enumerate(zip(contents, filenames)):
+            if self.cache_enabled:
+                keys[i] = self._content_key(content)
+                cached = self._cache_get(keys[i])
+                if cached is not None:
+                    result_dicts[i] = {**cached, "file_name": filename}
+                    continue
+            misses.append(i)
+        if not misses:
+            return result_dicts
         
-        try:
-            result = self.classify_file(tmp_path, use_cache=False)
-            result["file_name"] = filename
-            return result
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
+        start_time = time.perf_counter()
+        results = self._classifier.classify_eml_bytes_batch(
+            [contents[i] for i in misses], [filenames[i] for i in misses]
+        )
+        batch_time = time.perf_counter() - start_time
+        # Inference is shared, so each file is charged an equal slice of the batch time
+        processing_time = batch_time / len(results)
+        
+        errors = 0
+        for i, result in zip(misses, results):
+            result_dicts[i] = self._result_to_dict(result, filenames[i], processing_time)
+            if result.error:
+                errors += 1
+            elif keys[i]:
+                self._cache_put(keys[i], result_dicts[i])
+        self._record(batch_time, len(results), errors)
+        
+        logger.info(
+            f"Classified batch of {len(results)} files "
+            f"({batch_time:.2f}s)"
+        )
+        return result_dicts
     
     def classify_batch(self, filepaths: List[str]) -> List[Dict]:
         """
-        Classify multiple email files
+        Classify multiple email files, submitting all uncached files to the model together
         
         Args:
             filepaths: List of paths to .eml files
@@ -202,23 +328,95 @@ class EmailClassifierService:
         Returns:
             List of classification results
         """
-        results = []
-        total_files = len(filepaths)
+        if not self._model_loaded:
+            raise RuntimeError("Model not loaded. Cannot perform classification.")
         
+        total_files = len(filepaths)
         logger.info(f"Starting batch classification of {total_files} files")
         
-        for i, filepath in enumerate(filepaths, 1):
-            logger.info(f"Processing file {i}/{total_files}: {os.path.basename(filepath)}")
-            result = self.classify_file(filepath)
-            results.append(result)
+        results: List[Optional[Dict]] = [None] * total_files
+        keys: List[Optional[tuple]] = [None] * total_files
+        misses = []
+        for i, filepath in enumerate(filepaths):
+            if self.cache_enabled:
+                keys[i] = self._get_file_hash(filepath)
+                cached = self._cache_get(keys[i]) if keys[i] else None
+                if cached is not None:
+                    results[i] = cached
+                    continue
+            misses.append(i)
+        
+        if misses:
+            start_time = time.perf_counter()
+            try:
+                classified = self._classifier.classify_eml_files([filepaths[i] for i in misses])
+            except Exception as e:
+                # Fall back to one file at a time so a bad file gets its own error entry
+                # and the others are still classified
+                logger.error(f"Batch classification failed, classifying files one by one: {e}")
+                for i in misses:
+                    results[i] = self._classify_single(
+                        self._classifier.classify_eml_file, filepaths[i], os.path.basename(filepaths[i]), keys[i],
+                        cache_errors=True,
+                    )
+            else:
+                batch_time = time.perf_counter() - start_time
+                # Inference is shared, so each file is charged an equal slice of the batch time
+                processing_time = batch_time / len(classified)
+                
+                errors = 0
+                for i, result in zip(misses, classified):
+                    results[i] = self._result_to_dict(result, os.path.basename(filepaths[i]), processing_time)
+                    if result.error:
+                        errors += 1
+                    elif keys[i]:
+                        self._cache_put(keys[i], results[i])
+                self._record(batch_time, len(classified), errors)
         
         logger.info(f"Batch classification completed. Processed {len(results)} files")
         return results
     
+    def _result_to_dict(self, result: ClassificationResult, file_name: str, processing_time: float) -> Dict:
+        """Convert a ClassificationResult to the API dictionary format"""
+        return {
+            "file_name": file_name,
+            "classification": result.chosen,
+            "confidence_scores": [
+                {"label": label, "score": score} 
+                for label, score in result.scores
+            ],
+            "metadata": {
+                "subject": result.subject,
+                "sender": result.sender,
+                "recipient": result.recipient,
+                "date": None  # Add date parsing if needed
+            },
+            "processing_time_ms": round(processing_time * 1000, 2),
+            "model_version": self.model_id,
+            "error": result.error,
+            "raw_model_output": result.raw_model_output
+        }
+    
+    def _record(self, processing_time: float, count: int, errors: int):
+        """Update service statistics once for a call that classified count emails"""
+        with self._lock:
+            self._stats["total_classifications"] += count
+            self._stats["errors"] += errors
+            self._total_processing_time += processing_time
+    
+    def _stats_snapshot(self) -> Dict:
+        """Copy of the counters with the average processing time derived from the running sum"""
+        with self._lock:
+            stats = dict(self._stats)
+            total_time = self._total_processing_time
+        total = stats["total_classifications"]
+        stats["avg_processing_time"] = total_time / total if total else 0.0
+        return stats
+    
     def get_stats(self) -> Dict:
         """Get service statistics"""
         return {
-            **self._stats,
+            **self._stats_snapshot(),
             "model_loaded": self._model_loaded,
             "model_id": self.model_id,
             "labels": self.labels,
@@ -226,20 +424,50 @@ class EmailClassifierService:
         }
     
     def clear_cache(self):
-        """Clear the classification cache"""
-        if self._classification_cache:
-            self._classification_cache.clear()
+        """Clear the classification cache, including the persistent one"""
+        if self._classification_cache is not None:
+            with self._lock:
+                self._classification_cache.clear()
+                if self._cache_db is not None:
+                    self._cache_db.execute("DELETE FROM cache")
             logger.info("Classification cache cleared")
     
+    def close(self):
+        """Release the parse process pool and the persistent cache connection"""
+        if self._classifier is not None:
+            self._classifier.close()
+        with self._lock:
+            if self._cache_db is not None:
+                self._cache_db.close()
+                self._cache_db = None
+    
     def health_check(self) -> Dict:
         """Perform health check"""
         return {
             "status": "healthy" if self._model_loaded else "unhealthy",
             "model_loaded": self._model_loaded,
             "model_id": self.model_id,
-            "uptime_stats": self._stats
+            "uptime_stats": self._stats_snapshot()
         }
 
+def configure_torch_runtime(num_threads: int):
+    """
+    Pin PyTorch's thread pools before the model is loaded
+    
+    Args:
+        num_threads: Intra-op threads for this process (CPU count divided by worker count)
+    """
+    import torch
+    
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before any inter-op work has started
+        logger.warning("Inter-op thread count already fixed; leaving it unchanged")
+    torch.jit.enable_onednn_fusion(True)
+    logger.info(f"PyTorch using {num_threads} intra-op thread(s)")
+
 # Global service instance (singleton pattern)
 _service_instance = None
 
@@ -247,7 +475,17 @@ def get_classifier_service() -> EmailClassifierService:
     """Get the global classifier service instance"""
     global _service_instance
     if _service_instance is None:
-        _service_instance = EmailClassifierService()
+        # MODEL_QUANTIZATION may be "8bit" or "4bit"; unset keeps full-precision weights
+        _service_instance = EmailClassifierService(
+            quantization=os.getenv("MODEL_QUANTIZATION") or None,
+            compile_model=os.getenv("MODEL_COMPILE", "0") == "1",
+            backend=os.getenv("MODEL_BACKEND", "hf"),
+            kv_cache_dtype=os.getenv("MODEL_KV_CACHE_DTYPE", "fp8"),
+            parse_workers=int(os.getenv("PARSE_WORKERS", "0")),
+            fast_path=os.getenv("FAST_PATH", "0") == "1",
+            prefix_cache=os.getenv("MODEL_PREFIX_CACHE", "0") == "1",
+            cache_db_path=os.getenv("CACHE_DB_PATH") or None
+        )
     return _service_instance
 
 # Test function
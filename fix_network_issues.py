@@ -87,6 +87,10 @@ class SimpleFallbackClassifier:
             'unsubscribe', 'marketing', 'promotion', 'offer', 'discount', 
             'sale', 'newsletter', 'deal', 'free', 'limited time'
         ]
+        
+        # One alternation per list, so each body is scanned once per list rather than once per keyword
+        self._phishing_re = re.compile("|".join(map(re.escape, self.phishing_keywords)))
+        self._spam_re = re.compile("|".join(map(re.escape, self.spam_keywords)))
     
     def classify_eml_file(self, filepath: str) -> SimpleResult:
         """Classify email using simple rules"""
@@ -101,9 +105,9 @@ class SimpleFallbackClassifier:
             sender = self._extract_header(content, 'From:')
             recipient = self._extract_header(content, 'To:')
             
-            # Count keyword matches
-            phishing_score = sum(1 for keyword in self.phishing_keywords if keyword in content_lower)
-            spam_score = sum(1 for keyword in self.spam_keywords if keyword in content_lower)
+            # Count distinct keywords present
+            phishing_score = len(set(self._phishing_re.findall(content_lower)))
+            spam_score = len(set(self._spam_re.findall(content_lower)))
             
             # Determine classification
             if phishing_score > 0:
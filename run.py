@@ -7,21 +7,32 @@ import os
 import sys
 from pathlib import Path
 
+def parse_env(path=".env"):
+    """Parse a .env file into a dict in a single read; missing file gives {}"""
+    try:
+        lines = Path(path).read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+    env = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, _, value = line.partition('=')
+        # Remove quotes if present
+        env[key] = value.strip().strip('"\'')
+    return env
+
 def load_env_file():
     """Load environment variables from .env file"""
     env_file = Path(".env")
     if env_file.exists():
         print("📄 Loading environment variables from .env file...")
-        with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    # Remove quotes if present
-                    value = value.strip().strip('"\'')
-                    os.environ[key] = value
-                    if key in ['HF_API_KEY', 'HUGGINGFACEHUB_API_TOKEN']:
-                        print(f"✅ Loaded {key}")
+        env = parse_env(env_file)
+        os.environ.update(env)
+        for key in ['HF_API_KEY', 'HUGGINGFACEHUB_API_TOKEN']:
+            if key in env:
+                print(f"✅ Loaded {key}")
     else:
         print("⚠️  No .env file found")
 
@@ -52,11 +63,21 @@ def main():
     
     try:
         import uvicorn
+        try:
+            import uvloop  # noqa: F401
+            loop = "uvloop"
+        except ImportError:
+            loop = "asyncio"
+        # Each worker loads its own model in the startup hook; reload only works single-process
+        workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
         uvicorn.run(
             "app:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            reload=workers == 1,
+            workers=workers,
+            loop=loop,
+            http="httptools",
             log_level="info"
         )
     except KeyboardInterrupt:
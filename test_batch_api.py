@@ -3,11 +3,22 @@
 Test script for batch email classification API
 """
 
+import asyncio
 import os
 import time
+import httpx
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+# One keep-alive pool shared by every test instead of a new connection per call
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0))
+
+# Shared stand-in for results without scores (failed files return an empty list)
+_NO_SCORES = ({},)
 
 def test_single_file_api():
     """Test single file upload API"""
@@ -20,32 +31,32 @@ def test_single_file_api():
         return False
     
     try:
-        with open(sample_file, 'rb') as f:
-            files = {'file': (sample_file.name, f, 'application/octet-stream')}
-            
-            print(f"📤 Uploading: {sample_file.name}")
-            start_time = time.time()
-            
-            response = requests.post(
-                "http://localhost:8000/classify/upload",
-                files=files,
-                timeout=60
-            )
-            
-            elapsed = time.time() - start_time
+        # Read before timing so the measurement covers only the upload
+        files = {'file': (sample_file.name, sample_file.read_bytes(), 'application/octet-stream')}
+        
+        print(f"📤 Uploading: {sample_file.name}")
+        start_time = time.perf_counter()
+        
+        response = SESSION.post(
+            "http://localhost:8000/classify/upload",
+            files=files,
+            timeout=60
+        )
+        
+        elapsed = time.perf_counter() - start_time
+        
+        if response.status_code == 200:
+            data = response.json()
+            print(f"✅ Success! ({elapsed:.2f}s)")
+            print(f"🏷️  Classification: {data.get('classification', 'N/A')}")
+            print(f"📊 Confidence: {(data.get('confidence_scores') or _NO_SCORES)[0].get('score', 0):.2f}")
+            print(f"⏱️  Processing Time: {data.get('processing_time_ms', 0)}ms")
+            return True
+        else:
+            print(f"❌ Failed: {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
             
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ Success! ({elapsed:.2f}s)")
-                print(f"🏷️  Classification: {data.get('classification', 'N/A')}")
-                print(f"📊 Confidence: {data.get('confidence_scores', [{}])[0].get('score', 0):.2f}")
-                print(f"⏱️  Processing Time: {data.get('processing_time_ms', 0)}ms")
-                return True
-            else:
-                print(f"❌ Failed: {response.status_code}")
-                print(f"Response: {response.text}")
-                return False
-                
     except Exception as e:
         print(f"❌ Error: {e}")
         return False
@@ -68,21 +79,21 @@ def test_batch_api():
         print(f"   • {f.name}")
     
     try:
-        files = []
-        for sample_file in sample_files:
-            with open(sample_file, 'rb') as f:
-                files.append(('files', (sample_file.name, f.read(), 'application/octet-stream')))
+        files = [
+            ('files', (sample_file.name, sample_file.read_bytes(), 'application/octet-stream'))
+            for sample_file in sample_files
+        ]
         
         print(f"\n📤 Uploading batch of {len(files)} files...")
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        response = requests.post(
+        response = SESSION.post(
             "http://localhost:8000/classify/batch",
             files=files,
             timeout=120
         )
         
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         
         if response.status_code == 200:
             data = response.json()
@@ -100,7 +111,7 @@ def test_batch_api():
             print(f"\n📋 INDIVIDUAL RESULTS:")
             for i, result in enumerate(data.get('results', []), 1):
                 classification = result.get('classification', 'unknown')
-                confidence = result.get('confidence_scores', [{}])[0].get('score', 0)
+                confidence = (result.get('confidence_scores') or _NO_SCORES)[0].get('score', 0)
                 processing_time = result.get('processing_time_ms', 0)
                 
                 print(f"   {i}. {result.get('file_name', 'Unknown')}")
@@ -131,18 +142,23 @@ def test_api_endpoints():
         ("GET", "/models", "Model Information")
     ]
     
-    for method, endpoint, description in endpoints:
-        try:
-            if method == "GET":
-                response = requests.get(f"http://localhost:8000{endpoint}", timeout=10)
-            
-            if response.status_code == 200:
-                print(f"✅ {description}: OK")
-            else:
-                print(f"❌ {description}: {response.status_code}")
+    # The probes are independent, so issue them together over the shared session
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        futures = [
+            (executor.submit(SESSION.get, f"http://localhost:8000{endpoint}", timeout=10), description)
+            for method, endpoint, description in endpoints
+        ]
+        for future, description in futures:
+            try:
+                response = future.result()
                 
-        except Exception as e:
-            print(f"❌ {description}: Error - {e}")
+                if response.status_code == 200:
+                    print(f"✅ {description}: OK")
+                else:
+                    print(f"❌ {description}: {response.status_code}")
+                    
+            except Exception as e:
+                print(f"❌ {description}: Error - {e}")
 
 def test_error_handling():
     """Test error handling with invalid files"""
@@ -154,7 +170,7 @@ def test_error_handling():
         test_content = b"This is not an EML file"
         files = {'file': ('test.txt', test_content, 'text/plain')}
         
-        response = requests.post(
+        response = SESSION.post(
             "http://localhost:8000/classify/upload",
             files=files,
             timeout=30
@@ -171,6 +187,24 @@ def test_error_handling():
     # Test with oversized file (if we had one)
     print("✅ Error handling tests completed")
 
+async def _timed_upload(client, name, content):
+    """POST one upload and return (status_code, elapsed seconds)"""
+    start_time = time.perf_counter()
+    response = await client.post(
+        "http://localhost:8000/classify/upload",
+        files={'file': (name, content, 'application/octet-stream')},
+    )
+    return response.status_code, time.perf_counter() - start_time
+
+async def _concurrent_uploads(name, content, count):
+    """Fire count uploads at once over one pooled client"""
+    limits = httpx.Limits(max_keepalive_connections=8)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        return await asyncio.gather(
+            *(_timed_upload(client, name, content) for _ in range(count)),
+            return_exceptions=True,
+        )
+
 def test_performance():
     """Test performance with multiple concurrent requests"""
     print("\n🧪 Testing Performance")
@@ -181,34 +215,29 @@ def test_performance():
         print("❌ Sample file not found for performance testing")
         return
     
-    # Test sequential requests
-    print("📊 Testing sequential requests...")
+    # Test concurrent requests
+    print("📊 Testing concurrent requests...")
+    content = sample_file.read_bytes()
     times = []
     
-    for i in range(3):
-        try:
-            with open(sample_file, 'rb') as f:
-                files = {'file': (sample_file.name, f, 'application/octet-stream')}
-                
-                start_time = time.time()
-                response = requests.post(
-                    "http://localhost:8000/classify/upload",
-                    files=files,
-                    timeout=60
-                )
-                elapsed = time.time() - start_time
-                
-                if response.status_code == 200:
-                    times.append(elapsed)
-                    print(f"   Request {i+1}: {elapsed:.2f}s")
-                else:
-                    print(f"   Request {i+1}: Failed ({response.status_code})")
-                    
-        except Exception as e:
-            print(f"   Request {i+1}: Error - {e}")
+    start_time = time.perf_counter()
+    outcomes = asyncio.run(_concurrent_uploads(sample_file.name, content, 3))
+    wall_time = time.perf_counter() - start_time
+    
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            print(f"   Request {i+1}: Error - {outcome}")
+            continue
+        status_code, elapsed = outcome
+        if status_code == 200:
+            times.append(elapsed)
+            print(f"   Request {i+1}: {elapsed:.2f}s")
+        else:
+            print(f"   Request {i+1}: Failed ({status_code})")
     
     if times:
         avg_time = sum(times) / len(times)
+        print(f"📈 Wall-clock for {len(outcomes)} requests: {wall_time:.2f}s")
         print(f"📈 Average response time: {avg_time:.2f}s")
         print(f"📈 Min/Max: {min(times):.2f}s / {max(times):.2f}s")
 
@@ -219,7 +248,7 @@ def main():
     
     # Check if server is running
     try:
-        response = requests.get("http://localhost:8000/", timeout=5)
+        response = SESSION.get("http://localhost:8000/", timeout=5)
         print("✅ Server is running")
     except Exception as e:
         print(f"❌ Server not accessible: {e}")
@@ -275,4 +304,7 @@ def main():
     return True
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        SESSION.close()
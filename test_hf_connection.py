@@ -5,19 +5,13 @@ Test HuggingFace API connection and key validity
 
 import os
 import requests
-from pathlib import Path
+
+from run import parse_env
 
 def load_env_file():
-    """Load environment variables from .env file"""
-    env_file = Path(".env")
-    if env_file.exists():
-        with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    value = value.strip().strip('"\'')
-                    os.environ[key] = value
+    """Load environment variables from .env file; variables already set take precedence"""
+    for key, value in parse_env(".env").items():
+        os.environ.setdefault(key, value)
 
 def test_hf_connection():
     """Test HuggingFace API connection"""
@@ -35,44 +29,45 @@ def test_hf_connection():
     
     print(f"✅ API key found: {hf_key[:10]}...")
     
-    # Test basic API access
-    try:
-        print("🌐 Testing basic HuggingFace API access...")
-        headers = {"Authorization": f"Bearer {hf_key}"}
+    # Both API checks hit huggingface.co, so share one authenticated keep-alive connection
+    with requests.Session() as session:
+        session.headers["Authorization"] = f"Bearer {hf_key}"
         
-        # Test with a simple API call
-        response = requests.get(
-            "https://huggingface.co/api/whoami",
-            headers=headers,
-            timeout=10
-        )
+        # Test basic API access
+        try:
+            print("🌐 Testing basic HuggingFace API access...")
+            # Test with a simple API call
+            response = session.get(
+                "https://huggingface.co/api/whoami",
+                timeout=10
+            )
         
-        if response.status_code == 200:
-            user_info = response.json()
-            print(f"✅ API key is valid! User: {user_info.get('name', 'Unknown')}")
-        else:
-            print(f"❌ API key validation failed: {response.status_code}")
-            print(f"Response: {response.text}")
-            return False
+            if response.status_code == 200:
+                user_info = response.json()
+                print(f"✅ API key is valid! User: {user_info.get('name', 'Unknown')}")
+            else:
+                print(f"❌ API key validation failed: {response.status_code}")
+                print(f"Response: {response.text}")
+                return False
             
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Network error: {e}")
-        return False
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Network error: {e}")
+            return False
     
-    # Test model access
-    try:
-        print("🤖 Testing Gemma model access...")
-        model_url = "https://huggingface.co/api/models/google/gemma-3-270m-it"
+        # Test model access
+        try:
+            print("🤖 Testing Gemma model access...")
+            model_url = "https://huggingface.co/api/models/google/gemma-3-270m-it"
         
-        response = requests.get(model_url, headers=headers, timeout=10)
+            response = session.get(model_url, timeout=10)
         
-        if response.status_code == 200:
-            print("✅ Gemma model is accessible!")
-        else:
-            print(f"⚠️  Model access issue: {response.status_code}")
+            if response.status_code == 200:
+                print("✅ Gemma model is accessible!")
+            else:
+                print(f"⚠️  Model access issue: {response.status_code}")
             
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️  Model access error: {e}")
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️  Model access error: {e}")
     
     # Test transformers library
     try:
@@ -4,9 +4,25 @@ Test script to classify sample-201.eml and handle unknown results
 """
 
 import os
+import re
 from pathlib import Path
 from email_classifier import GemmaEmailClassifier
 
+# Indicator phrases for the enhanced fallback, each list matched in one pass
+_SUSPICIOUS_RE = re.compile("|".join(map(re.escape, [
+    "verify account", "click here", "urgent", "suspended",
+    "confirm identity", "update payment", "security alert",
+    "pending transaction", "withdrawal", "bitcoin", "crypto"
+])))
+# Same phishing phrases over the undecoded body of a plain-text email, so a hit skips MIME decoding
+_SUSPICIOUS_BYTES_RE = re.compile(
+    _SUSPICIOUS_RE.pattern.encode(), re.IGNORECASE
+)
+_SPAM_RE = re.compile("|".join(map(re.escape, [
+    "unsubscribe", "marketing", "promotion", "offer",
+    "discount", "sale", "newsletter"
+])))
+
 def test_sample_201():
     """Test classification of sample-201.eml"""
     print("🧪 Testing sample-201.eml Classification")
@@ -82,6 +98,29 @@ def test_sample_201():
         print(f"❌ Classification failed: {e}")
         return False
 
+def _raw_body(email_content):
+    """Bytes after the header block (the first blank line), or nothing if there is no body"""
+    ends = [end for end in (email_content.find(b"\r\n\r\n"), email_content.find(b"\n\n")) if end >= 0]
+    if not ends:
+        return b""
+    end = min(ends)
+    return memoryview(email_content)[end + (4 if email_content.startswith(b"\r\n\r\n", end) else 2):]
+
+def _plain_text_body(email_content):
+    """
+    The raw body when it is exactly the text that would be classified: a single text/plain part
+    without a transfer encoding. Anything else (multipart, HTML, base64, quoted-printable) is None.
+    """
+    from email import policy
+    from email.parser import BytesHeaderParser
+    
+    headers = BytesHeaderParser(policy=policy.default).parsebytes(email_content)
+    if headers.get_content_type() != "text/plain":
+        return None
+    if headers.get("Content-Transfer-Encoding", "7bit").strip().lower() not in ("7bit", "8bit", "binary"):
+        return None
+    return _raw_body(email_content)
+
 def classify_with_enhanced_prompt(classifier, filepath):
     """Try classification with enhanced prompting for unknown cases"""
     try:
@@ -89,6 +128,15 @@ def classify_with_enhanced_prompt(classifier, filepath):
         with open(filepath, 'rb') as f:
             email_content = f.read()
         
+        # A plain-text body can be scanned as it is on disk without decoding the message; other
+        # emails (HTML markup, multipart, encoded bodies) go through the extracted-text scan below
+        body = _plain_text_body(email_content)
+        raw_hits = _SUSPICIOUS_BYTES_RE.findall(body) if body is not None else []
+        if raw_hits:
+            found_patterns = list(dict.fromkeys(hit.decode().lower() for hit in raw_hits))
+            print(f"🚨 Found suspicious patterns: {found_patterns}")
+            return "phishing"
+        
         # Extract text using the classifier's method
         from email import policy
         from email.parser import BytesParser
@@ -103,26 +151,15 @@ def classify_with_enhanced_prompt(classifier, filepath):
         print("🔍 Analyzing email content for suspicious patterns...")
         
         # Check for common phishing indicators
-        suspicious_patterns = [
-            "verify account", "click here", "urgent", "suspended", 
-            "confirm identity", "update payment", "security alert",
-            "pending transaction", "withdrawal", "bitcoin", "crypto"
-        ]
-        
         content_lower = text_content.lower()
-        found_patterns = [pattern for pattern in suspicious_patterns if pattern in content_lower]
+        found_patterns = list(dict.fromkeys(_SUSPICIOUS_RE.findall(content_lower)))
         
         if found_patterns:
             print(f"🚨 Found suspicious patterns: {found_patterns}")
             return "phishing"
         
         # Check for spam indicators
-        spam_patterns = [
-            "unsubscribe", "marketing", "promotion", "offer", 
-            "discount", "sale", "newsletter"
-        ]
-        
-        found_spam = [pattern for pattern in spam_patterns if pattern in content_lower]
+        found_spam = list(dict.fromkeys(_SPAM_RE.findall(content_lower)))
         
         if found_spam:
             print(f"📧 Found spam patterns: {found_spam}")
@@ -163,9 +200,8 @@ def analyze_email_content(filepath):
         print(f"Subject: {subject}")
         print(f"From: {sender}")
         
-        # Get text content
-        clf = GemmaEmailClassifier()
-        text_content = clf._extract_text(msg)
+        # Get text content; _extract_text is static, so no model needs loading here
+        text_content = GemmaEmailClassifier._extract_text(msg)
         
         print(f"Content length: {len(text_content)} characters")
         print(f"First 300 characters:")
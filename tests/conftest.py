@@ -0,0 +1,59 @@
+"""
+Shared fixtures: a GemmaEmailClassifier that never loads a model, so parsing, batching and
+the service/API layers run for real while every text is "classified" as phishing.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_classifier import GemmaEmailClassifier  # noqa: E402
+
+# The From header makes email.headerregistry raise AttributeError as soon as it is read
+MALFORMED_HEADER_EML = b"From: a@[\r\nTo: b@example.com\r\nSubject: hello\r\n\r\nSee you tomorrow.\r\n"
+GOOD_EML = b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Lunch\r\n\r\nSee you at noon.\r\n"
+
+
+class ModelFreeClassifier(GemmaEmailClassifier):
+    """GemmaEmailClassifier with the model call replaced by a fixed answer"""
+
+    def __init__(self, labels=None, **kwargs):
+        self.labels = labels or ["phishing", "spam", "benign"]
+        self.fast_path = False
+        self.parse_workers = 0
+        self._parse_pool = None
+        self.pipeline_chunk_size = 256
+        self.text_cache_size = 0
+        self.compiled = False
+        self.llm = None
+
+    def _run_texts(self, texts, labs):
+        return [(labs[0], [(labs[0], 1.0)], None) for _ in texts]
+
+    def warmup(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def classifier():
+    return ModelFreeClassifier()
+
+
+@pytest.fixture(scope="session")
+def api_client():
+    """The FastAPI app with its startup/shutdown hooks run around a model-free service"""
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+    import classifier_service
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(classifier_service, "GemmaEmailClassifier", ModelFreeClassifier)
+        mp.setattr(
+            app_module, "get_classifier_service", lambda: classifier_service.EmailClassifierService(cache_enabled=False)
+        )
+        with TestClient(app_module.app) as client:
+            yield client
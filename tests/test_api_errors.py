@@ -0,0 +1,28 @@
+"""API-level handling of emails that cannot be read"""
+
+from conftest import GOOD_EML, MALFORMED_HEADER_EML
+
+
+def test_upload_malformed_header_returns_error_entry(api_client):
+    response = api_client.post(
+        "/classify/upload", files={"file": ("bad.eml", MALFORMED_HEADER_EML, "message/rfc822")}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["file_name"] == "bad.eml"
+    assert data["classification"] is None
+    assert data["error"]
+
+
+def test_batch_malformed_header_fails_only_that_file(api_client):
+    files = [
+        ("files", ("a.eml", GOOD_EML, "message/rfc822")),
+        ("files", ("bad.eml", MALFORMED_HEADER_EML, "message/rfc822")),
+        ("files", ("b.eml", GOOD_EML, "message/rfc822")),
+    ]
+    response = api_client.post("/classify/batch", files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert [r["classification"] for r in data["results"]] == ["phishing", None, "phishing"]
+    assert data["successful_classifications"] == 2
+    assert data["failed_classifications"] == 1
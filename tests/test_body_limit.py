@@ -0,0 +1,79 @@
+"""Oversized request bodies are refused before the endpoint parses them"""
+
+import asyncio
+
+from fastapi import FastAPI, Request
+
+from app import BodySizeLimitMiddleware
+
+LIMIT = 100
+
+
+def _run(headers, chunks):
+    """Send chunks through the middleware to an app that reads the whole body"""
+    reads = []
+    sent = []
+    parsed = []
+    inner = FastAPI()
+
+    @inner.post("/upload")
+    async def upload(request: Request):
+        parsed.append(await request.body())
+        return {"ok": True}
+
+    pending = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+
+    async def receive():
+        message = pending.pop(0)
+        reads.append(message)
+        return message
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/upload",
+        "raw_path": b"/upload",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 1),
+        "server": ("testserver", 80),
+    }
+    asyncio.run(BodySizeLimitMiddleware(inner, limits={"/upload": LIMIT})(scope, receive, send))
+    return sent[0]["status"], reads, parsed
+
+
+def test_declared_length_over_limit_is_rejected_unread():
+    status, reads, parsed = _run([(b"content-length", b"1000")], [b"x" * 1000])
+    assert status == 413
+    assert reads == []
+    assert parsed == []
+
+
+def test_streamed_body_is_cut_off_at_the_limit():
+    status, reads, parsed = _run([], [b"x" * 60] * 10)
+    assert status == 413
+    # Reading stops with the chunk that crosses the limit
+    assert len(reads) == 2
+    assert parsed == []
+
+
+def test_body_within_limit_passes_through():
+    status, reads, parsed = _run([(b"content-length", b"80")], [b"x" * 40, b"y" * 40])
+    assert status == 200
+    assert parsed == [b"x" * 40 + b"y" * 40]
+
+
+def test_upload_endpoint_refuses_declared_oversized_body(api_client):
+    response = api_client.post(
+        "/classify/upload",
+        content=b"--b--\r\n",
+        headers={"content-type": "multipart/form-data; boundary=b", "content-length": str(11 * 1024 * 1024)},
+    )
+    assert response.status_code == 413
@@ -0,0 +1,49 @@
+"""A malformed email fails on its own instead of taking its batch down with it"""
+
+from conftest import GOOD_EML, MALFORMED_HEADER_EML, ModelFreeClassifier
+
+
+def test_bytes_batch_isolates_malformed_header(classifier):
+    results = classifier.classify_eml_bytes_batch(
+        [GOOD_EML, MALFORMED_HEADER_EML, GOOD_EML], ["a.eml", "bad.eml", "b.eml"]
+    )
+    assert [r.file for r in results] == ["a.eml", "bad.eml", "b.eml"]
+    assert results[0].chosen == results[2].chosen == "phishing"
+    assert results[1].chosen is None
+    assert results[1].error.startswith("Failed to read EML")
+
+
+def test_files_batch_isolates_malformed_header(classifier, tmp_path):
+    good = tmp_path / "good.eml"
+    bad = tmp_path / "bad.eml"
+    good.write_bytes(GOOD_EML)
+    bad.write_bytes(MALFORMED_HEADER_EML)
+    results = classifier.classify_eml_files([str(good), str(bad)])
+    assert results[0].chosen == "phishing" and results[0].error is None
+    assert results[1].chosen is None and results[1].error
+
+
+class ExplodingClassifier(ModelFreeClassifier):
+    """Fails the whole model call whenever one of the texts mentions EXPLODE"""
+
+    def _run_texts(self, texts, labs):
+        if any("EXPLODE" in t for t in texts):
+            raise RuntimeError("model failed")
+        return super()._run_texts(texts, labs)
+
+
+def test_service_batch_isolates_failing_file(monkeypatch, tmp_path):
+    import classifier_service
+
+    monkeypatch.setattr(classifier_service, "GemmaEmailClassifier", ExplodingClassifier)
+    service = classifier_service.EmailClassifierService(cache_enabled=False)
+    paths = []
+    for name, body in [("a.eml", GOOD_EML), ("bad.eml", GOOD_EML.replace(b"noon", b"EXPLODE")), ("b.eml", GOOD_EML)]:
+        (tmp_path / name).write_bytes(body)
+        paths.append(str(tmp_path / name))
+
+    results = service.classify_batch(paths)
+    assert [r["file_name"] for r in results] == ["a.eml", "bad.eml", "b.eml"]
+    assert results[0]["classification"] == results[2]["classification"] == "phishing"
+    assert results[1]["classification"] is None
+    assert "model failed" in results[1]["error"]
@@ -0,0 +1,28 @@
+"""Files on disk and uploaded bytes turn into the same prompt text"""
+
+from email_classifier import _prepare_eml_file
+
+CRLF_EML = (
+    b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Account notice\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n\r\n"
+    b"Please verify your account.\r\nThanks,\r\nSupport\r\n"
+)
+
+
+def test_file_and_bytes_give_identical_text(classifier, tmp_path):
+    path = tmp_path / "crlf.eml"
+    path.write_bytes(CRLF_EML)
+    _, from_file = _prepare_eml_file(str(path), classifier.labels)
+    _, from_bytes = classifier._prepare_bytes(CRLF_EML, "crlf.eml", None)
+    assert from_file is not None
+    assert from_file == from_bytes
+
+
+def test_prescan_reads_only_plain_text_bodies():
+    from test_sample import _plain_text_body
+
+    assert bytes(_plain_text_body(CRLF_EML)) == b"Please verify your account.\r\nThanks,\r\nSupport\r\n"
+    html = b"From: a@example.com\r\nContent-Type: text/html\r\n\r\n<a class='urgent'>Hello</a>\r\n"
+    encoded = b"From: a@example.com\r\nContent-Transfer-Encoding: base64\r\n\r\nSGVsbG8=\r\n"
+    assert _plain_text_body(html) is None
+    assert _plain_text_body(encoded) is None